@@ -1,13 +1,19 @@
+import asyncio
 import dotenv
 import os
 import argparse
 import yaml
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable
 from rich.console import Console
 from rich.color import Color
 
 from discovery import AttackSurface, Node, NodeType
-from helpers import DiscoveryAIClient, DiscoveryAiValidator, DiscoveryAiValidatorPartly
+from helpers import AIResponseCache, DiscoveryAIClient, DiscoveryAiValidator, DiscoveryAiValidatorPartlyBatch
 
+# Use the libyaml based dumper if PyYAML was built with it, it is several times faster
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
 
 def main():
     dotenv.load_dotenv()
@@ -18,6 +24,17 @@ def main():
 
     # Set the maximum number of iterations of the discovery process
     MAX_NODES_TO_PROCESS = int(os.getenv("MAX_NODES_TO_PROCESS", 30))
+    # Searches returning more results are not expanded, 0 disables the limit
+    MAX_EXPANSION_PER_DIRECTION = int(os.getenv("MAX_EXPANSION_PER_DIRECTION", 2000))
+    # Throttling of API calls, 0 disables it
+    NETLAS_REQUESTS_PER_MINUTE = int(os.getenv("NETLAS_REQUESTS_PER_MINUTE", 120))
+    OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+    # Expiration of the on-disk cache of AI responses, 0 disables the cache
+    AI_CACHE_TTL_DAYS = float(os.getenv("AI_CACHE_TTL_DAYS", 7))
+    # Number of threads used to run AI queries and Netlas searches concurrently
+    MAX_WORKERS = 8
+    # Number of queued nodes, which search directions are refreshed in background
+    PREFETCH_NODES = 4
 
     if not OPENAI_API_KEY:
         raise ValueError("The OPENAI_API_KEY environment variable is not set.")    
@@ -44,17 +61,30 @@ def main():
         "ai": "dark_orange",
         "error": "bold red",
     }
-    def output_progress(title: str, message: str = "", actor: str = ""):
+    # The message can be passed as a callable, so it is built only if it will be printed
+    def format_progress(title: str, message: str | Callable[[], str] = "", actor: str = "") -> str | None:
         if args.debug and actor != "error":
-            return
+            return None
         color = colors.get(actor, Color.default().name)
         msg = f"[{color}]{title}[/{color}]"
         if args.verbose or args.debug:
+            msg_text = message() if callable(message) else message
             msg += f"\n"
-            for line in message.splitlines():
+            for line in msg_text.splitlines():
                 msg += f"  {line}\n"
             msg += f"\n"
-        console.print(msg)
+        return msg
+    def output_progress(title: str, message: str | Callable[[], str] = "", actor: str = ""):
+        msg = format_progress(title, message, actor)
+        if msg is not None:
+            console.print(msg)
+    # Print several progress messages with a single render pass
+    def output_progress_many(entries: list[tuple[str, str | Callable[[], str], str]]):
+        if console.quiet:
+            return
+        msgs = [msg for msg in (format_progress(*entry) for entry in entries) if msg is not None]
+        if msgs:
+            console.print("\n".join(msgs))
         
 
     # Load system and repeat prompts from files.
@@ -66,22 +96,55 @@ def main():
         repeat_prompt = file.read()
     
     # Initialize the AI client. Target domain is passed with the system prompt to bound the scope.
-    ai = DiscoveryAIClient(OPENAI_API_KEY, OPENAI_MODEL, f"{system_prompt} **{root_domain}**", repeat_prompt)
+    # Valid responses are cached on disk, so identical queries (e.g. a rerun on the same target) don't reach the API.
+    ai_cache = AIResponseCache(ttl=AI_CACHE_TTL_DAYS * 24 * 60 * 60) if AI_CACHE_TTL_DAYS > 0 else None
+    ai = DiscoveryAIClient(OPENAI_API_KEY, OPENAI_MODEL, f"{system_prompt} **{root_domain}**", repeat_prompt, OPENAI_REQUESTS_PER_MINUTE, cache=ai_cache)
+
+    # Review "partly" searches concurrently. All parts of one search are reviewed with a single batched AI query.
+    # Results are returned in the order of the searches, each one maps part indexes to the items to keep.
+    async def review_batch(searches: list[tuple[int, list[Node]]]) -> list[dict[int, list[str]]]:
+        coros = []
+        for direction, new_nodes in searches:
+            ai_query = f"PARTLY BATCH REQUEST for `{direction}`:\n\n"
+            # Items are sorted, so the query (and its cache key) doesn't depend on the set iteration order
+            for i, new_node in enumerate(new_nodes):
+                ai_query += f"part {i}:\n"
+                ai_query += "\n".join(sorted(new_node)) + "\n"
+            # Each search gets its own validator, since the searches are reviewed concurrently
+            validator = DiscoveryAiValidatorPartlyBatch(list(new_nodes))
+            coros.append(ai.partlyAddQueryBatchAsync(ai_query, validator=validator.validate))
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results  # type: ignore
 
     # Initialize the attack surface with the root domain.
-    surface = AttackSurface(api_key=NETLAS_API_KEY, apibase=NETLAS_BASE_URL)
+    surface = AttackSurface(api_key=NETLAS_API_KEY, apibase=NETLAS_BASE_URL, requests_per_minute=NETLAS_REQUESTS_PER_MINUTE)
     surface.append(Node(root_domain, NodeType.DOMAIN, [root_domain]))
 
 
     # Here is the main discovery loop.
     # The loop continues until all unprocessed by AI nodes will be processed
     # or the maximum number of nodes to process is reached.
+    # The runner keeps a single event loop for the whole session, so the async AI client can reuse its connections.
     try:
-        with console.status("") as status:
+        with console.status("") as status, asyncio.Runner() as runner, ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+
+            # Refresh search directions of the next queued nodes in background.
+            # Prefetch is an optimization, a failed one is reported, and the directions are requested again on access.
+            def report_prefetch_error(future: Future[None]) -> None:
+                if not future.cancelled() and future.exception() is not None:
+                    output_progress("Discovery: Prefetch of search directions failed", str(future.exception()), actor="error")
+            def prefetch_next() -> None:
+                future = pool.submit(surface.prefetch_search_directions, surface.peek_unprocessed(PREFETCH_NODES))
+                future.add_done_callback(report_prefetch_error)
             
             processed_counter = 0
-            while len(surface.unprocessedByAiNodes) > 0 and processed_counter < MAX_NODES_TO_PROCESS:
-                node = selectNodeToProcess(surface.unprocessedByAiNodes)
+            while processed_counter < MAX_NODES_TO_PROCESS:
+                node = surface.pop_next_unprocessed()
+                if node is None:
+                    break
                 status.update(f"Queue: {len(surface.unprocessedByAiNodes)}, Processed: {processed_counter}, Processing '{node.label}'...")
                 
                 # Skip nodes that have no search directions available, nowhere to search
@@ -91,15 +154,59 @@ def main():
                     continue
 
                 # Initialize validator and query the AI model to choose search directions
-                output_progress(f"Discovery: Searches for '{node.label}'", yaml.dump(node.to_dict(), sort_keys=False), actor="discovery")
-                validator = DiscoveryAiValidator([d.to_dict() for d in node.searchDirections], 20)
-                answer = ai.searchDirectionsQuery(f"DIRECTION REQUEST:\n\n {yaml.dump(node.to_dict(), sort_keys=False)}", validator=validator.validate)
-                formatted_answer = "\n".join(f"{key}: {value}" for key, value in answer.items())
-                output_progress(f"{ai.respondedModel}: Decision for {node.label}", formatted_answer, actor="ai")
-
-                # Make searches for directions selected by AI to add to the attack surface
-                for direction in answer["add"]:
-                    new_nodes = surface.search(int(direction), node)
+                # The node is converted and dumped once, the same YAML is used for the AI query and the progress output
+                node_dict = node.to_dict()
+                node_yaml = yaml.dump(node_dict, sort_keys=False, Dumper=YAML_DUMPER)
+                output_progress(f"Discovery: Searches for '{node.label}'", node_yaml, actor="discovery")
+                validator = DiscoveryAiValidator(node_dict["search_directions"], 20)  # type: ignore
+
+                # Searches are started as soon as the AI streams a selected direction, while the rest of the decision is generated.
+                # Streamed directions are not validated yet, so the results are only fetched, and are added to the surface
+                # once the final decision is known: "add" searches at once, "partly" searches after the AI review.
+                # Searches with too many results are skipped, they mostly bring shared infrastructure and noise.
+                directions = node.searchDirectionsById
+                searches: dict[int, Future[list[Node]]] = {}
+                skipped: set[int] = set()
+                def submit_search(direction: int) -> None:
+                    sd = directions.get(direction)
+                    if sd is None or direction in searches or direction in skipped:
+                        return
+                    if not sd.isExpandable(MAX_EXPANSION_PER_DIRECTION):
+                        skipped.add(direction)
+                        output_progress(f"Discovery: Search {direction} skipped ({sd.count} results exceed the limit)", actor="discovery")
+                        return
+                    searches[direction] = pool.submit(surface.fetch, sd, node)
+
+                ai_future = pool.submit(
+                    ai.searchDirectionsQueryStream,
+                    f"DIRECTION REQUEST:\n\n {node_yaml}",
+                    validator=validator.validate,
+                    on_add=submit_search,
+                    on_partly=submit_search
+                )
+
+                # Search directions are requested lazily, on first access. While the AI is deciding,
+                # fetch them for the next queued nodes, so Netlas latency overlaps with the AI latency.
+                prefetch_next()
+
+                answer = ai_future.result()
+                output_progress(f"{ai.respondedModel}: Decision for {node.label}", str(answer), actor="ai")
+
+                # Start searches missed while streaming, and drop searches for directions missing in the final decision
+                # (e.g. streamed by a response that failed validation), their results were not added to the surface.
+                selected = {*answer.add, *answer.partly}
+                for direction in selected:
+                    submit_search(direction)
+                for direction, future in searches.items():
+                    if direction not in selected:
+                        future.cancel()
+                # "add" results are merged in the order of the decision, so the result doesn't depend on timing
+                results = {direction: surface.merge(searches[direction].result()) for direction in dict.fromkeys(answer.add) if direction in searches}
+
+                for direction in answer.add:
+                    if direction not in results:
+                        continue
+                    new_nodes = results[direction]
                     # Length can be 0 because the surface searches and adds nodes. 
                     # Items that are already on the surface are filtered out.
                     # So as a result node can contain zero items after addition.
@@ -108,26 +215,34 @@ def main():
                         output_progress(f"Discovery: Search {direction} filtered out (all items are already on the surface)", actor="discovery")
                         continue
                     for new_node in new_nodes:
-                        output_progress(f"Discovery: Search {direction} - {new_node.label} added", f"{"\n".join(new_node)}", actor="discovery")
+                        output_progress(f"Discovery: Search {direction} - {new_node.label} added", partial("\n".join, new_node), actor="discovery")
                 
-                # Make searches for directions selected by AI to review and add to the attack surface
-                for direction in answer["partly"]:
-                    new_nodes = surface.search(int(direction), node)
+                # "partly" results are not added before the review, so items rejected by the AI never claim a place on the surface.
+                # Only items that are not on the surface yet are reviewed.
+                partly_searches: list[tuple[int, list[Node]]] = []
+                for direction in dict.fromkeys(answer.partly):
+                    if direction not in searches or direction in results:
+                        continue
+                    new_nodes = surface.filter_known(searches[direction].result())
                     # Another empty node check
                     if len(new_nodes) == 0:
                         output_progress(f"Discovery: Search {direction} filtered out (all items are already on the surface)", actor="discovery")
                         continue
-                    # Make revew query to AI
+                    partly_searches.append((direction, new_nodes))
+
+                # Make review queries to AI, one batched query per search, all searches are reviewed concurrently
+                # Items kept by the review are added to the surface in the order of the decision,
+                # the progress is printed after the loop, all at once
+                partly_answers = runner.run(review_batch(partly_searches)) if partly_searches else []
+                progress: list[tuple[str, str | Callable[[], str], str]] = []
+                for (direction, new_nodes), partly_answer in zip(partly_searches, partly_answers):
                     for i, new_node in enumerate(new_nodes):
-                        ai_query = f"PARTLY REQUEST for `{direction}`, part {i}:\n\n"
-                        ai_query += "\n".join([f"{item}" for item in new_node])
-                        partly_answer = ai.partlyAddQuery(ai_query, validator=DiscoveryAiValidatorPartly(list(new_node)).validate)
-                        new_node.intersection_update(partly_answer)
+                        new_node.intersection_update(partly_answer[i])
                         if len(new_node) == 0:
-                            surface.remove(new_node)
-                            output_progress(f"Discovery: Search {direction} - {new_node.label} filtered out by Ai", actor="discovery")
-                            continue
-                        output_progress(f"Discovery: Search {direction} - {new_node.label} partly added", f"{"\n".join(new_node)}", actor="discovery")
+                            progress.append((f"Discovery: Search {direction} - {new_node.label} filtered out by Ai", "", "discovery"))
+                    for new_node in surface.merge(new_nodes):
+                        progress.append((f"Discovery: Search {direction} - {new_node.label} partly added", partial("\n".join, new_node), "discovery"))
+                output_progress_many(progress)
 
                 node.isAiProcessed = True
                 processed_counter += 1
@@ -139,45 +254,8 @@ def main():
         unique_items: dict[str, list[str]] = surface.unique_items_to_dict()
         for l in unique_items.values():
             l.sort()
-        print(yaml.dump(unique_items, sort_keys=True))
-
-
-
-# An optimization of processing order.
-# The order is based on the type of node and the label of the domain node.
-# Type of nodes and directions that are most likely yield strong connections, processed first.
-def selectNodeToProcess(nodes: list[Node]) -> Node:
-    if len(nodes) == 0:
-        raise RuntimeError("No unprocessed node found")
-
-    custom_order = {
-        NodeType.HTTP_TRACKER: 0,
-        NodeType.FAVICON: 1,
-        NodeType.ORGANIZATION: 2,
-        NodeType.PERSON: 3,
-        NodeType.EMAIL: 4,
-        NodeType.PHONE: 5,
-        NodeType.ADDRESS: 6,
-        NodeType.NETWORK_NAME: 7,
-        NodeType.AS_NAME: 8,
-        NodeType.DOMAIN: 9,
-        NodeType.DNS_TXT: 10,
-        NodeType.IP: 11,
-        NodeType.TEXT: 12,
-        NodeType.IP_RANGE: 13,
-        NodeType.ASN: 14,
-        NodeType.JARM: 15
-    }
-    sorted_nodes = sorted(nodes, key=lambda node: custom_order.get(node.type, 99))
-    if sorted_nodes[0].type is NodeType.DOMAIN:
-        domains = [node for node in sorted_nodes if node.type is NodeType.DOMAIN]
-        for domain in domains:
-            if domain.label == "Mailservers for domain":
-                return domain
-            if domain.label == "NS servers for domain":
-                return domain
-    return sorted_nodes[0]
-    
+        print(yaml.dump(unique_items, sort_keys=True, Dumper=YAML_DUMPER))
+
 
 
 if __name__ == "__main__":
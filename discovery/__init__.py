@@ -1,6 +1,6 @@
 from .search_direction import SearchDirection   # type: ignore
-from .node_type import NodeType                 # type: ignore
+from .node_type import NodeType, NodeTypePriority  # type: ignore
 from .node import Node                          # type: ignore
 from .surface import AttackSurface              # type: ignore
 from .client import ApiClient                   # type: ignore
-
+from .throttle import TokenBucket               # type: ignore
\ No newline at end of file
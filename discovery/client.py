@@ -1,10 +1,16 @@
 import json
+import random
+import orjson
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from concurrent.futures import ThreadPoolExecutor
 
 from .search_direction import SearchDirection
-from .node_type import NodeType
+from .node_type import NODE_TYPE_BY_VALUE
 from .node import Node
+from .throttle import TokenBucket
 import time
 
 
@@ -18,22 +24,31 @@ class ApiClient:
 
     # Maximum number of retry attempts for API calls.
     MAX_RETIRES: int = 100
-    # Default wait time (in seconds) between retries.
-    DEFAULT_RETRY_WAIT_TIME: int = 10
+    # Initial and maximum wait time (in seconds) of the exponential backoff between retries.
+    RETRY_INITIAL_WAIT: float = 1
+    RETRY_MAX_WAIT: float = 60
+    # Maximum number of API calls sent concurrently by the batch methods, e.g. `getSearchDirectionsMany`.
+    MAX_CONCURRENT_REQUESTS: int = 8
+    # Connect and read timeouts (in seconds) for API calls.
+    REQUEST_TIMEOUT: tuple[float, float] = (5, 60)
 
     api_key: str
     apibase: str
     _headers: dict[str, str]
     _verify_ssl: bool
+    _session: requests.Session
+    _bucket: TokenBucket | None
+    _executor: ThreadPoolExecutor
 
 
-    def __init__(self, api_key: str, apibase: str = "https://app.netlas.io") -> None:
+    def __init__(self, api_key: str, apibase: str = "https://app.netlas.io", requests_per_minute: int = 0) -> None:
         """
         Initializes the ApiClient with the provided API key and base URL.
 
         Args:
             api_key (str): The API key for authentication.
             apibase (str, optional): The base URL for the API. Defaults to "https://app.netlas.io".
+            requests_per_minute (int, optional): The maximum number of API calls per minute, 0 disables throttling. Defaults to 0.
 
         Returns:
             None
@@ -49,13 +64,25 @@ class ApiClient:
             # "Accept": "application/x-ndjson",
             "X-Api-Key": self.api_key
             }
+        # Persistent session keeps connections alive between API calls.
+        # Retries are handled by `_execute_api_call`, so the adapter doesn't retry on its own.
+        self._session = requests.Session()
+        self._session.headers.update(self._headers)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=0))
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        # Throttle API calls in advance, so concurrent calls don't run into rate limiting
+        self._bucket = TokenBucket.per_minute(requests_per_minute) if requests_per_minute > 0 else None
+        # Batches of API calls are sent from a long-lived pool of threads sharing the session connections
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_REQUESTS, thread_name_prefix="netlas-api")
 
     def _execute_api_call(self, url: str, headers: dict[str,str], payload: dict[str, object]):
         """
         Executes an API call with retry logic.
 
         Handles HTTP errors, including rate limiting (HTTP 429) and server errors (HTTP 504).
-        Retries the request based on the response headers and status codes.
+        Retries wait as requested by the `Retry-After` header on rate limiting,
+        otherwise with capped exponential backoff and jitter.
 
         Args:
             url (str): The API endpoint URL.
@@ -63,26 +90,37 @@ class ApiClient:
             payload (dict[str, object]): The JSON payload for the request.
 
         Returns:
-            requests.Response: The HTTP response object.
+            requests.Response: The HTTP response object. The body is not read, so it can be parsed while it is being received,
+                the caller is responsible for closing the response.
 
         Raises:
             Exception: If all retry attempts fail or an unrecoverable error occurs.
         """
-        for _ in range(1, self.MAX_RETIRES + 1):
+        # The payload is serialized once and reused by retries, the headers already declare JSON content
+        body = orjson.dumps(payload)
+        for attempt in range(self.MAX_RETIRES):
+            retry_after: float | None = None
             try:
-                response = requests.post(url, headers=headers, json=payload, verify=self._verify_ssl)
+                if self._bucket:
+                    self._bucket.acquire()
+                response = self._session.post(url, headers=headers, data=body, verify=self._verify_ssl, timeout=self.REQUEST_TIMEOUT, stream=True)
+                if not response.ok:
+                    # Read the body of an error response, it is used in the error details, and release the connection
+                    response.content
+                    response.close()
                 response.raise_for_status()
+                if self._bucket:
+                    self._bucket.reward()
                 return response
             
             except requests.exceptions.HTTPError as http_err:
                 r = getattr(http_err, 'response', None)
                 
-                # Handle rate limiting (HTTP 429)
-                if r is not None and r.status_code == 429 and "Retry-After" in r.headers:
-                    wait_time = int(r.headers.get("Retry-After", "60"))
-                    if wait_time > self.DEFAULT_RETRY_WAIT_TIME:
-                        wait_time -= self.DEFAULT_RETRY_WAIT_TIME
-                    time.sleep(wait_time)
+                # Handle rate limiting (HTTP 429) - slow down the throttling and retry
+                if r is not None and r.status_code == 429:
+                    if self._bucket:
+                        self._bucket.penalize()
+                    retry_after = self._parse_retry_after(r.headers.get("Retry-After"))
 
                 # Handle HTTP 504 timeout - just retry
                 elif r is not None and r.status_code == 504:
@@ -111,12 +149,25 @@ class ApiClient:
             except Exception as err:
                 raise Exception(f"Unhandled error occurred: {str(err)}") from err
             
-            # Sleep for the default retry wait time before retrying
-            time.sleep(self.DEFAULT_RETRY_WAIT_TIME)
+            # Wait before retrying: as requested by the API, or with exponential backoff and jitter
+            if retry_after is None:
+                retry_after = min(self.RETRY_MAX_WAIT, self.RETRY_INITIAL_WAIT * 2 ** attempt)
+                retry_after += random.uniform(0, self.RETRY_INITIAL_WAIT)
+            time.sleep(retry_after)
 
         # If we reach here, it means all retries failed
         raise Exception(f"Failed to execute API call after {self.MAX_RETIRES} attempts")
-        
+
+
+    @staticmethod
+    def _parse_retry_after(value: str | None) -> float | None:
+        """
+        Parses the value of the `Retry-After` header given in seconds. Returns None if it is missing or not a number.
+        """
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
 
 
     def getSearchDirections(self, node: Node) -> tuple[list[SearchDirection], str]:
@@ -147,25 +198,53 @@ class ApiClient:
         }
         response = self._execute_api_call(url, self._headers, payload)
 
-        # Parse the response
-        # The response is a stream of JSON objects, one per line (ndjson format).
-        # Each JSON object contains the search field ID, count of results, and preview - search direction.
+        # Parse the response while it is being received, closing it returns the connection to the pool
         ret: list[SearchDirection] = []
-        for line in response.iter_lines():
-            if line:
-                ldict = json.loads(line)
-                key = int(ldict.get("search_field_id"))
-                count = int(ldict.get("count", 0))
-                sd = SearchDirection(
-                    id=key,
-                    search_field=ldict.get("search_field"),
-                    count=count,
-                    preview=ldict.get("preview")
-                )
-                # Add the search direction to the list if a search will bring at least one result 
-                if count > 0:
-                    ret.append(sd)
+        with response:
+            for line in response.iter_lines(chunk_size=65536, decode_unicode=False):
+                self._parse_search_directions_line(line, ret)
         return ret, response.headers.get("X-Count-ID", "")
+
+
+    def getSearchDirectionsMany(self, nodes: list[Node]) -> list[tuple[list[SearchDirection], str]]:
+        """
+        Gets search directions for several nodes at once, see `getSearchDirections`.
+
+        Requests are independent from each other, so they are sent concurrently from a pool of threads,
+        reusing the pooled connections of the session.
+
+        Args:
+            nodes (list[Node]): The `Node` objects, for which search directions are requested.
+
+        Returns:
+            list[tuple[list[SearchDirection], str]]: Search directions and the value of the `X-Count-Id` header for each node, in the order of nodes.
+        """
+        if len(nodes) == 0:
+            return []
+        if len(nodes) == 1:
+            return [self.getSearchDirections(nodes[0])]
+        return list(self._executor.map(self.getSearchDirections, nodes))
+
+
+    def _parse_search_directions_line(self, line: str | bytes, directions: list[SearchDirection]) -> None:
+        """
+        Parses a line of the search directions response and appends the search direction to the list.
+        """
+        # The response is a stream of JSON objects, one per line (ndjson format).
+        # Each JSON object contains the search field ID, count of results, and preview - search direction.
+        if not line:
+            return
+        ldict = orjson.loads(line)
+        key = int(ldict.get("search_field_id"))
+        count = int(ldict.get("count", 0))
+        # Add the search direction to the list if a search will bring at least one result 
+        if count > 0:
+            directions.append(SearchDirection(
+                id=key,
+                search_field=ldict.get("search_field"),
+                count=count,
+                preview=ldict.get("preview")
+            ))
     
 
 
@@ -186,6 +265,20 @@ class ApiClient:
         
         # Prepare the API call
         url = f"{self.apibase}/api/discovery/group_of_nodes_result/"
+        payload, headers = self._search_request(direction, node)
+        response = self._execute_api_call(url, headers=headers, payload=payload)
+        # Parse the response while it is being received, closing it returns the connection to the pool
+        search_results: dict[str, Node] = {}
+        with response:
+            for line in response.iter_lines(chunk_size=65536, decode_unicode=False):
+                self._parse_search_line(direction, line, search_results)
+        return list(search_results.values())
+
+
+    def _search_request(self, direction: SearchDirection, node: Node) -> tuple[dict[str, object], dict[str, str]]:
+        """
+        Prepares the payload and headers of a search request.
+        """
         payload: dict[str, object] = {
             "node_type": node.type.value,
             "node_value": list(node),
@@ -195,24 +288,26 @@ class ApiClient:
         # Add the X-Count-ID header to the request
         # The value of the X-Count-ID header is used on the backend to identify the search directions list for the given node.
         headers["X-Count-ID"] = node.count_id 
-        response = self._execute_api_call(url, headers=headers, payload=payload)
+        return payload, headers
 
-        # Parse the response
+
+    def _parse_search_line(self, direction: SearchDirection, line: str | bytes, search_results: dict[str, Node]) -> None:
+        """
+        Parses a line of the search response and adds found items to the nodes in `search_results`, grouped by type.
+        """
         # The response is a stream of JSON objects, one per line (ndjson format).
         # Each JSON object represents a group of items of the same type - a search result for one of node items.
         # Search can return results of different types.
         # A new node will be created for each type of the search result.
-        search_results: dict[str, list[str]] = {}
-        for line in response.iter_lines():
-            if line:
-                ldict = json.loads(line)
-                if ldict.get("is_valid", False) and len(ldict.get("node_value", [])) > 0:
-                    key = ldict.get("node_type")
-                    if key in search_results.keys():
-                        search_results[key].extend(ldict.get("node_value"))
-                    else:
-                        search_results[key] = ldict.get("node_value")
-        ret: list[Node] = []
-        for type, values in search_results.items():
-            ret.append(Node(direction.search_field, NodeType(type), values))
-        return ret
\ No newline at end of file
+        # Items are added to the nodes right away, so duplicates are dropped while merging and the values are not copied twice.
+        if not line:
+            return
+        ldict = orjson.loads(line)
+        values = ldict.get("node_value")
+        if ldict.get("is_valid", False) and values:
+            key = ldict.get("node_type")
+            node = search_results.get(key)
+            if node is None:
+                search_results[key] = Node(direction.search_field, NODE_TYPE_BY_VALUE[key], values)
+            else:
+                node.update(values)
\ No newline at end of file
@@ -1,6 +1,6 @@
-from .node_type import NodeType
+from .node_type import NodeType, NODE_TYPE_PRIORITY
 from .search_direction import SearchDirection
-from typing import Callable
+from typing import AbstractSet, Callable, Iterable
 
 class Node(set[str]):
     """
@@ -19,25 +19,118 @@ class Node(set[str]):
 
     label: str
     _type: NodeType
-    isAiProcessed: bool = False
+    _priority: int
+    _is_ai_processed: bool = False
     _count_id: str
     _search_directions: list[SearchDirection]
-    _items_hash: int
+    _directions_by_id: dict[int, SearchDirection]
+    _dirty: bool = True
     _search_directions_updater: Callable[["Node"], None]
     _is_search_directions_updater_set: bool = False
+    _change_listener: Callable[["Node"], None] | None = None
+    _ai_processed_listener: Callable[["Node"], None] | None = None
     
     
-    def __init__(self, label: str, type: NodeType, items: list[str]) -> None:
+    def __init__(self, label: str, type: NodeType, items: Iterable[str]) -> None:
         """Initializes a Node instance.
 
         Args:
             label (str): The label of the group, usually matching search field name.
             type (NodeType): The type of the group, see `NodeType`.
-            items (list[str]): An initial list of items to be added to the group.
+            items (Iterable[str]): Initial items to be added to the group, duplicates are dropped.
         """
         super().__init__(items)
         self.label = label
         self._type = type
+        self._priority = NODE_TYPE_PRIORITY[type]
+        self._search_directions = []
+        self._directions_by_id = {}
+
+
+    # Override base set methods modifying the items, to track whether the search directions are still relevant.
+    # Changes are detected by the size of the set, which is enough for all methods except the symmetric difference.
+
+    def _mark_changed(self) -> None:
+        self._dirty = True
+        if self._change_listener is not None:
+            self._change_listener(self)
+
+    def _track_change(self, size: int) -> None:
+        if len(self) != size:
+            self._mark_changed()
+
+    def add(self, element: str) -> None:
+        size = len(self)
+        super().add(element)
+        self._track_change(size)
+
+    def discard(self, element: str) -> None:
+        size = len(self)
+        super().discard(element)
+        self._track_change(size)
+
+    def remove(self, element: str) -> None:
+        super().remove(element)
+        self._mark_changed()
+
+    def pop(self) -> str:
+        element = super().pop()
+        self._mark_changed()
+        return element
+
+    def clear(self) -> None:
+        size = len(self)
+        super().clear()
+        self._track_change(size)
+
+    def update(self, *s: Iterable[str]) -> None:
+        size = len(self)
+        super().update(*s)
+        self._track_change(size)
+
+    def intersection_update(self, *s: Iterable[object]) -> None:
+        size = len(self)
+        super().intersection_update(*s)
+        self._track_change(size)
+
+    def difference_update(self, *s: Iterable[object]) -> None:
+        size = len(self)
+        super().difference_update(*s)
+        self._track_change(size)
+
+    def symmetric_difference_update(self, s: Iterable[str]) -> None:
+        super().symmetric_difference_update(s)
+        self._mark_changed()
+
+    def __ior__(self, value: AbstractSet[str]):  # type: ignore
+        self.update(value)
+        return self
+
+    def __iand__(self, value: AbstractSet[object]):
+        self.intersection_update(value)
+        return self
+
+    def __isub__(self, value: AbstractSet[object]):
+        self.difference_update(value)
+        return self
+
+    def __ixor__(self, value: AbstractSet[str]):  # type: ignore
+        self.symmetric_difference_update(value)
+        return self
+
+    def internItems(self, table: dict[str, str]) -> None:
+        """
+        Replaces the items with the equal strings stored in the table, and stores the items missing from it.
+        The same item found by several searches is then kept as a single string object.
+        The items of the group don't change, so the search directions stay relevant.
+
+        Args:
+            table (dict[str, str]): The interning table, mapping each item to its stored string.
+        """
+        replaced = [item for item in self if table.setdefault(item, item) is not item]
+        for item in replaced:
+            super().discard(item)
+            super().add(table[item])
 
 
     def setSearchDirections(self, search_directions: list[SearchDirection], count_id: str) -> None:
@@ -55,8 +148,9 @@ class Node(set[str]):
             None
         """
         self._search_directions = search_directions
+        self._directions_by_id = {direction.id: direction for direction in search_directions}
         self._count_id = count_id
-        self._items_hash = hash(frozenset(self))
+        self._dirty = False
 
     @property
     def searchDirections(self) -> list[SearchDirection]:
@@ -71,6 +165,14 @@ class Node(set[str]):
             else:
                 raise ValueError("Search directions are not set or are not relevant.")
         return self._search_directions
+
+    @property
+    def searchDirectionsById(self) -> dict[int, SearchDirection]:
+        """
+        Returns the search directions for this Node instance, mapped by the search direction ID.
+        """
+        self.searchDirections  # refreshes the search directions, if they are not relevant
+        return self._directions_by_id
     
     @property
     def count_id(self) -> str:
@@ -91,14 +193,12 @@ class Node(set[str]):
         Checks if the search directions are relevant for this Node instance.
 
         Search directions are considered relevant if they were set and the group has not changed since that moment.
-        The check is done by comparing the hash of the items in the group with the stored hash.
+        Changes of the group are tracked by the overridden set methods, so the check doesn't depend on the group size.
 
         Returns:
             bool: True if the search directions are relevant, False otherwise.
         """
-        if not self._search_directions or (self._items_hash != hash(frozenset(self))):
-            return False
-        return True
+        return bool(self._search_directions) and not self._dirty
     
     def setSearchDirectionUpdater(self, callback: Callable[["Node"], None]) -> None:
         """
@@ -115,11 +215,61 @@ class Node(set[str]):
         self._search_directions_updater = callback
         self._is_search_directions_updater_set = True
 
+    def setChangeListener(self, callback: Callable[["Node"], None] | None) -> None:
+        """
+        Assigns a callback function to be called when the items of this Node instance are changed.
+
+        This method is typically invoked by the `AttackSurface` object, to keep its index of unique items up to date.
+
+        Args:
+            callback (Callable[[Node], None] | None): A function to be called after the change, or None to remove the listener.
+
+        Returns:
+            None
+        """
+        self._change_listener = callback
+
+    def setAiProcessedListener(self, callback: Callable[["Node"], None] | None) -> None:
+        """
+        Assigns a callback function to be called when the `isAiProcessed` flag of this Node instance is changed.
+
+        This method is typically invoked by the `AttackSurface` object, to keep track of the nodes not processed by AI.
+
+        Args:
+            callback (Callable[[Node], None] | None): A function to be called after the change, or None to remove the listener.
+
+        Returns:
+            None
+        """
+        self._ai_processed_listener = callback
+
+    @property
+    def isAiProcessed(self) -> bool:
+        """
+        Indicates if the group was processed by AI.
+        """
+        return self._is_ai_processed
+
+    @isAiProcessed.setter
+    def isAiProcessed(self, value: bool) -> None:
+        if value == self._is_ai_processed:
+            return
+        self._is_ai_processed = value
+        if self._ai_processed_listener is not None:
+            self._ai_processed_listener(self)
+
 
     @property
     def type(self) -> NodeType:
         return self._type
 
+    @property
+    def priority(self) -> int:
+        """
+        Returns the processing priority of the node type, see `NodeTypePriority`.
+        """
+        return self._priority
+
     def to_dict(self) -> dict[str, object]:
         """
         Converts the Node instance to a dictionary representation.
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class NodeType(Enum):
@@ -23,4 +23,36 @@ class NodeType(Enum):
         ORGANIZATION = "organization"
         PERSON = "person"
         PHONE = "phone"
-        TEXT = "text"        
\ No newline at end of file
+        TEXT = "text"        
+
+
+
+class NodeTypePriority(IntEnum):
+        """
+        NodeTypePriority defines the order in which nodes of each type are processed.
+        Members mirror `NodeType` names, lower values are processed first.
+        Types of nodes and directions that are most likely yield strong connections, processed first.
+        """
+        HTTP_TRACKER = 0
+        FAVICON = 1
+        ORGANIZATION = 2
+        PERSON = 3
+        EMAIL = 4
+        PHONE = 5
+        ADDRESS = 6
+        NETWORK_NAME = 7
+        AS_NAME = 8
+        DOMAIN = 9
+        DNS_TXT = 10
+        IP = 11
+        TEXT = 12
+        IP_RANGE = 13
+        ASN = 14
+        JARM = 15
+
+
+# Processing priority of each node type, see `NodeTypePriority`.
+NODE_TYPE_PRIORITY: dict[NodeType, int] = {nt: int(NodeTypePriority[nt.name]) for nt in NodeType}
+
+# Lookup of node types by their values, faster than `NodeType(value)` in parsing loops.
+NODE_TYPE_BY_VALUE: dict[str, NodeType] = {nt.value: nt for nt in NodeType}
\ No newline at end of file
@@ -28,6 +28,18 @@ class SearchDirection:
         self.count = count
         self.preview = preview
 
+    def isExpandable(self, max_count: int) -> bool:
+        """
+        Checks if the search by this direction is small enough to be expanded.
+
+        Args:
+            max_count (int): The maximum number of results allowed for the search, 0 means no limit.
+
+        Returns:
+            bool: True if the search will return no more than `max_count` results, False otherwise.
+        """
+        return max_count <= 0 or self.count <= max_count
+
     def to_dict(self) -> dict[str, Any]:
         """
         Converts the SearchDirection instance to a dictionary as returned from the Discovery API.
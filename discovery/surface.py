@@ -1,4 +1,9 @@
-from typing import Any, Iterable, SupportsIndex
+import heapq
+import itertools
+import operator
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator, SupportsIndex, overload
 
 from .node import Node
 from .node_type import NodeType
@@ -6,52 +11,114 @@ from .client import ApiClient
 from .search_direction import SearchDirection
 
 
+# Maximum number of search direction lists kept in the cache.
+SEARCH_DIRECTIONS_CACHE_SIZE = 4096
 
-class AttackSurface(list[Node]):
+# An optimization of processing order.
+# Nodes are processed in the order of their type priority, see `NodeTypePriority`.
+# Among domains, mailservers and NS servers are processed first.
+PROCESSING_ORDER_BY_LABEL: dict[str, int] = {
+    "Mailservers for domain": 0,
+    "NS servers for domain": 1,
+}
+
+
+class AttackSurface:
     """
     Represents the attack surface as a collection of nodes.
 
-    This class is a subclass of the built-in list class and provides additional functionality
-    for managing nodes in the attack surface. It is designed to work with the `Node` class,
+    This class wraps a list of nodes and provides a list-like interface for managing nodes in the attack surface.
+    Only the methods that keep the surface consistent (filtering, indexes, processing queue) are exposed,
+    so nodes can't be added or reordered bypassing them. It is designed to work with the `Node` class,
     which represents a group of items of the same type. The class also provides methods for
     searching nodes, filtering unique items, and updating search directions.
+    Unique items are indexed by node type, and added nodes are placed in a priority queue, see `pop_next_unprocessed`.
+    All modifications are guarded by a lock, so nodes can be added from several threads at once.
 
     Attributes:
         unprocessedByAiNodes (list[Node]): List of nodes that have not been processed by AI,
-            formed using the `Node.isAiProcessed` property.
+            tracked through the `Node.isAiProcessed` listener.
     """
 
+    __slots__ = ("_nodes", "_provider", "_last_search_results", "_lock", "_dir_cache", "_queue", "_queue_counter",
+                 "_unique_index", "_stale_types", "_unprocessed", "_interned")
+
+    _nodes: list[Node]
     _provider: ApiClient
     _last_search_results: list[Node]
+    _lock: threading.RLock
+    _dir_cache: OrderedDict[tuple[str, frozenset[str]], tuple[list[SearchDirection], str]]
+    _queue: list[tuple[tuple[int, int], int, Node]]
+    _queue_counter: itertools.count
+    _unique_index: dict[NodeType, set[str]]
+    _stale_types: set[NodeType]
+    _unprocessed: dict[int, Node]
+    _interned: dict[str, str]
     
 
-    def __init__(self, api_key: str, apibase: str) -> None:
+    def __init__(self, api_key: str, apibase: str, requests_per_minute: int = 0) -> None:
         """
         Initializes an AttackSurface instance.
 
         Args:
             api_key (str): The API key for authentication.
             apibase (str): The base URL for the API.
+            requests_per_minute (int, optional): The maximum number of API calls per minute, 0 disables throttling. Defaults to 0.
         """
-        super().__init__()
-        self._provider = ApiClient(api_key, apibase)
+        self._nodes = []
+        self._provider = ApiClient(api_key, apibase, requests_per_minute)
         self._last_search_results = []
+        self._lock = threading.RLock()
+        self._dir_cache = OrderedDict()
+        self._queue = []
+        self._queue_counter = itertools.count()
+        self._unique_index = {}
+        self._stale_types = set()
+        self._unprocessed = {}
+        self._interned = {}
     
 
-    # Override base List methods to ensure that the AttackSurface class behaves like a list
+    # List-like interface, the methods ensure that the AttackSurface class behaves like a list
+
+    def __iter__(self) -> Iterator[Node]:
+        return iter(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node: object) -> bool:
+        return node in self._nodes
+
+    @overload
+    def __getitem__(self, key: SupportsIndex) -> Node: ...
+    @overload
+    def __getitem__(self, key: slice) -> list[Node]: ...
+    def __getitem__(self, key: SupportsIndex | slice) -> Node | list[Node]:
+        return self._nodes[key]
+
+    def index(self, node: Node) -> int:
+        """
+        Returns the index of the first node equal to the given one.
+
+        Raises:
+            ValueError: If the node is not present.
+        """
+        return self._nodes.index(node)
 
     def _filter_and_register_node(self, node: Node) -> None:
         """
         Filters out duplicate items from the node and registers search direction updaters.
+        Search directions are requested on first access, see `Node.searchDirections`.
 
         Args:
             node (Node): The node to filter and register.
         """
-        _unique_items = self._unique_items()
-        if node.type in _unique_items.keys():
-            node.difference_update(_unique_items[node.type])
+        if len(node) == 0:
+            return
+        existing = self._unique_items_of(node.type)
+        if existing:
+            node.difference_update(existing)
         if len(node) > 0:
-            self._update_search_directions(node)
             node.setSearchDirectionUpdater(self._update_search_directions)
         
     def append(self, node: Node) -> None:
@@ -61,9 +128,12 @@ class AttackSurface(list[Node]):
         Args:
             node (Node): The node to be appended.
         """
-        self._filter_and_register_node(node)
-        if len(node) > 0:
-            super().append(node)
+        with self._lock:
+            self._filter_and_register_node(node)
+            if len(node) > 0:
+                self._nodes.append(node)
+                self._index_node(node)
+                self._enqueue(node)
         
     def extend(self, iterable: Iterable[Node]) -> None:
         """
@@ -72,8 +142,7 @@ class AttackSurface(list[Node]):
         Args:
             iterable (Iterable[Node]): An iterable of nodes to be added.
         """
-        for node in iterable:
-            self.append(node)
+        self._accept_many(iterable)
 
     def insert(self, index: SupportsIndex, item: Node) -> None:
         """
@@ -83,9 +152,12 @@ class AttackSurface(list[Node]):
             index (SupportsIndex): The index at which to insert the node.
             item (Node): The node to be inserted.
         """
-        self._filter_and_register_node(item)
-        if len(item) > 0:
-            super().insert(index, item)
+        with self._lock:
+            self._filter_and_register_node(item)
+            if len(item) > 0:
+                self._nodes.insert(index, item)
+                self._index_node(item)
+                self._enqueue(item)
 
     def __setitem__(self, key: SupportsIndex | slice, value: Any) -> None:
         """
@@ -104,9 +176,68 @@ class AttackSurface(list[Node]):
         else:
             if not isinstance(value, Node):
                 raise TypeError("Value must be a Node instance.")
-            self._filter_and_register_node(value)
-            super().__setitem__(key, value)
+            with self._lock:
+                self._unindex_node(self._nodes[key])
+                self._filter_and_register_node(value)
+                self._nodes[key] = value
+                self._index_node(value)
+                self._enqueue(value)
         
+    def remove(self, node: Node) -> None:
+        """
+        Removes the first node equal to the given one from the attack surface.
+
+        Args:
+            node (Node): The node to be removed.
+
+        Raises:
+            ValueError: If the node is not present.
+        """
+        with self._lock:
+            self._unindex_node(self._nodes.pop(self._nodes.index(node)))
+
+    def pop(self, index: SupportsIndex = -1) -> Node:
+        """
+        Removes and returns the node at the specified index.
+
+        Args:
+            index (SupportsIndex, optional): The index of the node to remove. Defaults to -1.
+
+        Returns:
+            Node: The removed node.
+        """
+        with self._lock:
+            node = self._nodes.pop(index)
+            self._unindex_node(node)
+            return node
+
+    def __delitem__(self, key: SupportsIndex | slice) -> None:
+        """
+        Removes the node or the slice of nodes from the attack surface.
+
+        Args:
+            key (SupportsIndex | slice): The index or slice of nodes to remove.
+        """
+        with self._lock:
+            removed = self._nodes[key]
+            del self._nodes[key]
+            for node in (removed if isinstance(key, slice) else [removed]):
+                self._unindex_node(node)
+
+    def clear(self) -> None:
+        """
+        Removes all nodes from the attack surface.
+        """
+        with self._lock:
+            for node in self._nodes:
+                node.setChangeListener(None)
+                node.setAiProcessedListener(None)
+            self._nodes.clear()
+            self._unique_index.clear()
+            self._stale_types.clear()
+            self._unprocessed.clear()
+            self._interned.clear()
+
     def __iadd__(self, iterable: Iterable[Node]):
         """
         Extends the attack surface with a list of nodes using the `+=` operator.
@@ -123,30 +254,136 @@ class AttackSurface(list[Node]):
 
     # Additional AttackSurface specific methods
 
-    def _unique_items(self) -> dict[NodeType, set[str]]:
+    def _unique_items_of(self, type: NodeType) -> set[str] | None:
         """
-        Returns a dictionary of unique items in the attack surface to filter elements during addition.
+        Returns the unique items of the given type, rebuilding them first if nodes of the type were changed.
+
+        Args:
+            type (NodeType): The node type.
 
         Returns:
-            dict[NodeType, set[str]]: A dictionary mapping node types to sets of unique items.
-        """
-        _unique_items: dict[NodeType, set[str]] = {}
-        for node in self:
-            if node.type not in _unique_items.keys():
-                _unique_items[node.type] = set()
-            _unique_items[node.type].update(node)
-        return _unique_items
+            set[str] | None: The unique items of the type, or None if there are no nodes of the type.
+        """
+        if type in self._stale_types:
+            self._rebuild_unique_items([type])
+        return self._unique_index.get(type)
+
+    def _rebuild_unique_items(self, types: Iterable[NodeType]) -> None:
+        """
+        Rebuilds the unique items of the given types from the nodes on the surface, in a single pass over the nodes.
+
+        Args:
+            types (Iterable[NodeType]): The node types to rebuild.
+        """
+        rebuilt: dict[NodeType, set[str]] = {type: set() for type in types}
+        # Local aliases keep attribute lookups out of the loop over all nodes
+        get_type = operator.attrgetter("type")
+        get_items = rebuilt.get
+        for node in self._nodes:
+            items = get_items(get_type(node))
+            if items is not None:
+                items.update(node)
+        self._unique_index.update(rebuilt)
+        self._stale_types.difference_update(rebuilt)
+
+    def _index_node(self, node: Node) -> None:
+        """
+        Adds items of the accepted node to the unique items index and starts tracking changes of the node.
+        Items are interned first, so equal items of different nodes share one string object.
+        """
+        node.internItems(self._interned)
+        self._unique_index.setdefault(node.type, set()).update(node)
+        node.setChangeListener(self._on_node_changed)
+        node.setAiProcessedListener(self._on_ai_processed)
+        if not node.isAiProcessed:
+            self._unprocessed[id(node)] = node
+
+    def _unindex_node(self, node: Node) -> None:
+        """
+        Removes items of the node from the unique items index.
+        Items of the nodes on the surface don't overlap, so the items are not shared with other nodes.
+        """
+        node.setChangeListener(None)
+        node.setAiProcessedListener(None)
+        self._unprocessed.pop(id(node), None)
+        if node.type not in self._stale_types and node.type in self._unique_index:
+            self._unique_index[node.type].difference_update(node)
+
+    def _on_node_changed(self, node: Node) -> None:
+        """
+        Callback function marking the unique items of the changed node type as stale.
+        """
+        with self._lock:
+            self._stale_types.add(node.type)
+
+    def _on_ai_processed(self, node: Node) -> None:
+        """
+        Callback function tracking the nodes not processed by AI. Nodes marked as unprocessed again are queued once more.
+        """
+        with self._lock:
+            if node.isAiProcessed:
+                self._unprocessed.pop(id(node), None)
+            else:
+                self._unprocessed[id(node)] = node
+                self._enqueue(node)
     
 
     def _update_search_directions(self, node: Node) -> None:
         """
         Callback function to update search directions for a node.
 
+        Search directions are cached by the node type and items, so the same group of items
+        is requested from the Discovery API only once (least recently used entries are evicted).
+
         Args:
             node (Node): The node for which to update search directions.
         """
-        directions, count_id = self._provider.getSearchDirections(node)
-        node.setSearchDirections(directions, count_id)
+        key = (node.type.value, frozenset(node))
+        cached = self._cached_search_directions(key)
+        if cached is None:
+            # The API call is made without the lock, so several nodes can be updated concurrently
+            cached = self._provider.getSearchDirections(node)
+            self._cache_search_directions(key, cached)
+        node.setSearchDirections(*cached)
+
+    def _cached_search_directions(self, key: tuple[str, frozenset[str]]) -> tuple[list[SearchDirection], str] | None:
+        with self._lock:
+            cached = self._dir_cache.get(key)
+            if cached is not None:
+                self._dir_cache.move_to_end(key)
+            return cached
+
+    def _cache_search_directions(self, key: tuple[str, frozenset[str]], value: tuple[list[SearchDirection], str]) -> None:
+        with self._lock:
+            self._dir_cache[key] = value
+            if len(self._dir_cache) > SEARCH_DIRECTIONS_CACHE_SIZE:
+                self._dir_cache.popitem(last=False)
+
+
+    def prefetch_search_directions(self, nodes: list[Node]) -> None:
+        """
+        Updates outdated search directions of several nodes at once.
+        Directions missing in the cache are requested from the Discovery API concurrently.
+
+        Nodes changed while the directions were requested keep their outdated state, so they are refreshed on access.
+
+        Args:
+            nodes (list[Node]): The nodes for which to update search directions.
+        """
+        outdated = [node for node in nodes if not node.isSearchDirectionsRelevant()]
+        keys = [(node.type.value, frozenset(node)) for node in outdated]
+        missing: list[int] = []
+        for i, (node, key) in enumerate(zip(outdated, keys)):
+            cached = self._cached_search_directions(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                node.setSearchDirections(*cached)
+        results = self._provider.getSearchDirectionsMany([outdated[i] for i in missing])
+        for i, result in zip(missing, results):
+            self._cache_search_directions(keys[i], result)
+            if frozenset(outdated[i]) == keys[i][1]:
+                outdated[i].setSearchDirections(*result)
     
 
     @property
@@ -157,7 +394,60 @@ class AttackSurface(list[Node]):
         Returns:
             list[Node]: List of unprocessed nodes.
         """
-        return [node for node in self if not node.isAiProcessed]
+        with self._lock:
+            return list(self._unprocessed.values())
+
+
+    def _enqueue(self, node: Node) -> None:
+        """
+        Places the node in the processing priority queue, if it is not processed by AI yet.
+
+        Args:
+            node (Node): The node to enqueue.
+        """
+        if node.isAiProcessed:
+            return
+        priority = (node.priority, PROCESSING_ORDER_BY_LABEL.get(node.label, 2))
+        heapq.heappush(self._queue, (priority, next(self._queue_counter), node))
+
+    def pop_next_unprocessed(self) -> Node | None:
+        """
+        Removes and returns the next node to be processed by AI, according to the node priority and `PROCESSING_ORDER_BY_LABEL`.
+        Nodes of the same priority are returned in the order they were added to the surface.
+
+        Nodes that were processed, emptied or removed from the surface since they had been queued are skipped.
+
+        Returns:
+            Node | None: The next node to process, or None if there are no unprocessed nodes.
+        """
+        with self._lock:
+            while self._queue:
+                _, _, node = heapq.heappop(self._queue)
+                if id(node) in self._unprocessed and len(node) > 0:
+                    return node
+            return None
+
+
+    def peek_unprocessed(self, count: int) -> list[Node]:
+        """
+        Returns up to `count` nodes that will be processed next, without removing them from the queue.
+        Only the head of the queue is visited, nodes skipped by `pop_next_unprocessed` are dropped on the way.
+
+        Args:
+            count (int): The maximum number of nodes to return.
+
+        Returns:
+            list[Node]: The next nodes to process, in the processing order.
+        """
+        entries: list[tuple[tuple[int, int], int, Node]] = []
+        with self._lock:
+            while self._queue and len(entries) < count:
+                entry = heapq.heappop(self._queue)
+                if id(entry[2]) in self._unprocessed and len(entry[2]) > 0:
+                    entries.append(entry)
+            for entry in entries:
+                heapq.heappush(self._queue, entry)
+        return [node for _, _, node in entries]
 
 
     def search(self, direction: SearchDirection | int, node: Node) -> list[Node]:
@@ -172,16 +462,90 @@ class AttackSurface(list[Node]):
         Returns:
             list[Node]: A list of nodes found during the search.
         """
+        return self.merge(self.fetch(direction, node))
+
+
+    def fetch(self, direction: SearchDirection | int, node: Node) -> list[Node]:
+        """
+        Requests Discovery API to search for nodes associated with the given `node`, without adding them to the attack surface.
+        Returned nodes can be added later with `merge`, e.g. once the search is confirmed.
+
+        Args:
+            direction (SearchDirection | int): The search direction to be used for the search.
+            node (Node): The group of elements to search by.
+
+        Returns:
+            list[Node]: A list of nodes found during the search, not filtered yet.
+        """
         if isinstance(direction, int):
-            direction = next(d for d in node.searchDirections if d.id == direction)
-        last_search_results: list[Node] = []
-        new_nodes = self._provider.search(direction, node)
-        for node in new_nodes:
-            self._filter_and_register_node(node)
-            if len(node) > 0:
-                last_search_results.append(node)
-                super().append(node)
-        return last_search_results
+            direction = node.searchDirectionsById[direction]
+        # The API call is made without the lock, so several searches can be executed concurrently
+        return self._provider.search(direction, node)
+
+
+    def filter_known(self, new_nodes: list[Node]) -> list[Node]:
+        """
+        Removes items that are already on the attack surface from the nodes, without adding the nodes to the surface.
+
+        Args:
+            new_nodes (list[Node]): Nodes returned by the search.
+
+        Returns:
+            list[Node]: Nodes that still contain items after filtering.
+        """
+        filtered: list[Node] = []
+        with self._lock:
+            for node in new_nodes:
+                existing = self._unique_items_of(node.type)
+                if existing:
+                    node.difference_update(existing)
+                if len(node) > 0:
+                    filtered.append(node)
+        return filtered
+
+
+    def merge(self, new_nodes: list[Node]) -> list[Node]:
+        """
+        Filters and registers nodes returned by the Discovery API search, and appends them to the attack surface.
+
+        Args:
+            new_nodes (list[Node]): Nodes returned by the search.
+
+        Returns:
+            list[Node]: Non-empty nodes added to the attack surface.
+        """
+        return self._accept_many(new_nodes)
+
+
+    def _accept_many(self, nodes: Iterable[Node]) -> list[Node]:
+        """
+        Filters several nodes in a single pass and appends the non-empty ones to the attack surface at once.
+
+        Each node is filtered against the unique items index, which is updated as nodes are accepted,
+        so the following nodes of the batch are filtered against the preceding ones as well.
+        Search directions are requested on first access, or ahead of it with `prefetch_search_directions`.
+
+        Args:
+            nodes (Iterable[Node]): The nodes to be added.
+
+        Returns:
+            list[Node]: Non-empty nodes added to the attack surface.
+        """
+        accepted: list[Node] = []
+        with self._lock:
+            for node in nodes:
+                if len(node) == 0:
+                    continue
+                existing = self._unique_items_of(node.type)
+                if existing:
+                    node.difference_update(existing)
+                if len(node) > 0:
+                    node.setSearchDirectionUpdater(self._update_search_directions)
+                    self._index_node(node)
+                    self._enqueue(node)
+                    accepted.append(node)
+            self._nodes.extend(accepted)
+        return accepted
     
     
     def unique_items_to_dict(self) -> dict[str, list[str]]:
@@ -192,8 +556,7 @@ class AttackSurface(list[Node]):
         Returns:
             dict[str, list[str]]: A dictionary of unique items in the attack surface.
         """
-        ret: dict[str, list[str]] = {}
-        _unique_items = self._unique_items()
-        for type, items in _unique_items.items():
-            ret[type.value] = list(items)
-        return ret
+        with self._lock:
+            if self._stale_types:
+                self._rebuild_unique_items(list(self._stale_types))
+            return {type.value: list(items) for type, items in self._unique_index.items() if items}
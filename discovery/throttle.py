@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket used to throttle requests to an API.
+
+    Each request takes a token from the bucket, tokens are refilled at a constant rate.
+    If the bucket is empty, the caller waits until a token is available, so bursts of
+    concurrent requests are spread in time instead of being rejected by the API with HTTP 429.
+
+    The refill rate adapts to the API: it is reduced when the API reports rate limiting
+    and is restored step by step after a series of successful requests.
+
+    Attributes:
+        capacity (float): The maximum number of tokens in the bucket (allowed burst size).
+        refill_rate (float): The current number of tokens added to the bucket per second.
+    """
+
+    # Refill rate multiplier applied when the API reports rate limiting.
+    BACKOFF_FACTOR: float = 0.9
+    # Number of successful requests after which the refill rate is increased back.
+    RECOVERY_SUCCESSES: int = 20
+
+    capacity: float
+    refill_rate: float
+    _max_refill_rate: float
+    _tokens: float
+    _updated: float
+    _successes: int
+    _condition: threading.Condition
+
+
+    def __init__(self, capacity: float, refill_rate: float) -> None:
+        """
+        Initializes the TokenBucket instance.
+
+        Args:
+            capacity (float): The maximum number of tokens in the bucket (allowed burst size).
+            refill_rate (float): The number of tokens added to the bucket per second.
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._max_refill_rate = refill_rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: int) -> "TokenBucket":
+        """
+        Creates a bucket allowing the given number of requests per minute, with bursts up to 10 seconds worth of requests.
+
+        Args:
+            requests_per_minute (int): The number of requests allowed per minute.
+
+        Returns:
+            TokenBucket: The new bucket.
+        """
+        return cls(capacity=max(1, requests_per_minute / 6), refill_rate=requests_per_minute / 60)
+
+
+    def _take(self, n: float) -> float:
+        """
+        Refills the bucket and takes `n` tokens if available. Must be called with the lock held.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the time (in seconds) to wait before the next attempt.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+        if self._tokens >= n:
+            self._tokens -= n
+            return 0
+        return (n - self._tokens) / self.refill_rate
+
+    def acquire(self, n: float = 1) -> None:
+        """
+        Takes `n` tokens from the bucket, blocking the calling thread until they are available.
+
+        Args:
+            n (float, optional): The number of tokens to take. Defaults to 1.
+        """
+        with self._condition:
+            while (wait := self._take(n)) > 0:
+                self._condition.wait(wait)
+
+    async def acquire_async(self, n: float = 1) -> None:
+        """
+        Takes `n` tokens from the bucket, suspending the calling coroutine until they are available.
+
+        Args:
+            n (float, optional): The number of tokens to take. Defaults to 1.
+        """
+        while True:
+            with self._condition:
+                wait = self._take(n)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+    def penalize(self) -> None:
+        """
+        Reduces the refill rate after the API reported rate limiting.
+        """
+        with self._condition:
+            self.refill_rate *= self.BACKOFF_FACTOR
+            self._successes = 0
+
+    def reward(self) -> None:
+        """
+        Registers a successful request, restoring the refill rate after a series of successes.
+        """
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.RECOVERY_SUCCESSES and self.refill_rate < self._max_refill_rate:
+                self.refill_rate = min(self._max_refill_rate, self.refill_rate / self.BACKOFF_FACTOR)
+                self._successes = 0
+                self._condition.notify_all()
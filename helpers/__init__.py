@@ -1,2 +1,3 @@
-from .aiclient import DiscoveryAIClient # type: ignore
-from .aivalidator import DiscoveryAiValidator, DiscoveryAiValidatorPartly # type: ignore
\ No newline at end of file
+from .aiclient import DiscoveryAIClient, AISearchDirectionsResponse, AIPartlyAddAnswer, AIPartlyBatchAnswer # type: ignore
+from .aicache import AIResponseCache # type: ignore
+from .aivalidator import DiscoveryAiValidator, DiscoveryAiValidatorPartly, DiscoveryAiValidatorPartlyBatch # type: ignore
\ No newline at end of file
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Iterable
+
+
+AI_CACHE_DIRECTORY = ".ai_cache"
+AI_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+
+
+class AIResponseCache:
+    """
+    A content-addressed on-disk cache of AI responses.
+
+    Responses are stored by the hash of the model, the response format and the messages identifying the query
+    (see `DiscoveryAIClient`), so the same query made again during the session, or in a rerun on the same target,
+    is answered without an API call.
+    Each entry is a separate JSON file, written atomically, so several processes can share the cache directory.
+    Expired entries are removed when the cache is opened.
+
+    Attributes:
+        _directory (str): The directory where the responses are stored.
+        _ttl (float): The time (in seconds) after which an entry expires.
+    """
+
+    __slots__ = ("_directory", "_ttl")
+
+    _directory: str
+    _ttl: float
+
+    def __init__(self, directory: str = AI_CACHE_DIRECTORY, ttl: float = AI_CACHE_TTL) -> None:
+        """
+        Initializes the AIResponseCache instance.
+
+        Args:
+            directory (str, optional): The directory where the responses are stored. Defaults to `AI_CACHE_DIRECTORY`.
+            ttl (float, optional): The time (in seconds) after which an entry expires. Defaults to `AI_CACHE_TTL`.
+        """
+        self._directory = directory
+        self._ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.prune()
+
+    def prune(self) -> None:
+        """
+        Removes expired entries and leftovers of interrupted writes from the cache directory.
+        """
+        deadline = time.time() - self._ttl
+        try:
+            entries = list(os.scandir(self._directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith((".json", ".tmp")) and entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+            except OSError:
+                # The entry may be removed by another process at the same time
+                pass
+
+    @staticmethod
+    def key(model: str, text_format: str, messages: Iterable[Any]) -> str:
+        """
+        Returns the cache key of a query.
+
+        Args:
+            model (str): The requested AI model.
+            text_format (str): The name of the expected response format.
+            messages (Iterable[Any]): The messages identifying the query, including the system prompt.
+
+        Returns:
+            str: The hex digest identifying the query.
+        """
+        data = json.dumps([model, text_format, list(messages)], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, f"{key}.json")
+
+    def get(self, key: str) -> tuple[str, str] | None:
+        """
+        Returns the cached response of a query, expired entries are removed.
+
+        Args:
+            key (str): The cache key, see `key`.
+
+        Returns:
+            tuple[str, str] | None: The responded model and the JSON of the parsed response, or None if there is no valid entry.
+        """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self._ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            return entry["model"], entry["output"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def set(self, key: str, model: str, output: str) -> None:
+        """
+        Stores the response of a query.
+
+        Args:
+            key (str): The cache key, see `key`.
+            model (str): The responded model.
+            output (str): The JSON of the parsed response.
+        """
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({"model": model, "output": output}, file)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            # The cache is an optimization, failing to store a response is not an error
+            pass
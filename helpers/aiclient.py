@@ -1,12 +1,25 @@
-from time import sleep
-from openai import OpenAI, RateLimitError, APITimeoutError, APIResponseValidationError
+import asyncio
+import functools
+import httpx
+import random
+import time
+from collections import deque
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APITimeoutError, APIResponseValidationError
 from openai.types.responses import ResponseInputItemParam
 from typing import Callable, Type, Any
 from pydantic import BaseModel
+from discovery.throttle import TokenBucket
+from .aicache import AIResponseCache
 
 
 OPENAI_TIMEOUT = 30  # seconds
 OPENAI_MESSAGES_HISTORY = 10
+OPENAI_MAX_CONCURRENT_REQUESTS = 4  # bound for concurrently running async queries
+OPENAI_RETRY_INITIAL_WAIT = 1  # seconds, initial wait of the exponential backoff on rate limiting
+OPENAI_TIMEOUT_RETRY_INITIAL_WAIT = 0.5  # seconds, initial wait of the exponential backoff on timeouts
+OPENAI_RETRY_MAX_WAIT = 60  # seconds
+OPENAI_MAX_CONNECTIONS = 32
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 16
 
 
 class AISearchDirectionsResponse(BaseModel):
@@ -21,20 +34,152 @@ class AIPartlyAddAnswer(BaseModel):
     def __str__(self) -> str:
         return "\n".join(self.nodes)
 
+class AIPartlyBatchPart(BaseModel):
+    part: int
+    nodes: list[str] = []
+
+class AIPartlyBatchAnswer(BaseModel):
+    parts: list[AIPartlyBatchPart] = []
+    def __str__(self) -> str:
+        return "\n".join(f"part {p.part}:\n" + "\n".join(p.nodes) for p in self.parts)
+
+class DirectionsStreamScanner:
+    """
+    An incremental scanner of the JSON text of `AISearchDirectionsResponse` being generated by the AI.
+
+    The text is fed in arbitrary chunks. Each integer is passed to the callback of its list
+    as soon as it is complete. A new JSON object (e.g. a retried response) resets the scanner,
+    but integers already passed to a callback are not passed again.
+    """
+
+    _callbacks: dict[str, Callable[[int], None]]
+    _emitted: set[tuple[str, int]]
+    _depth: int
+    _in_string: bool
+    _escape: bool
+    _string: str
+    _key: str
+    _array_key: str | None
+    _number: str
+
+    def __init__(self, callbacks: dict[str, Callable[[int], None]]) -> None:
+        """
+        Initializes the DirectionsStreamScanner instance.
+
+        Args:
+            callbacks (dict[str, Callable[[int], None]]): Callbacks for integers of the lists, by the list key.
+        """
+        self._callbacks = callbacks
+        self._emitted = set()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string = ""
+        self._key = ""
+        self._array_key = None
+        self._number = ""
+
+    def _emit(self) -> None:
+        if self._number and self._array_key in self._callbacks:
+            item = (self._array_key, int(self._number))
+            if item not in self._emitted:
+                self._emitted.add(item)
+                self._callbacks[self._array_key](item[1])
+        self._number = ""
+
+    def feed(self, text: str) -> None:
+        """
+        Feeds the next chunk of the generated text to the scanner.
+
+        Args:
+            text (str): The chunk of text.
+        """
+        for c in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._array_key is None:
+                        self._key = self._string
+                else:
+                    self._string += c
+            elif c == '"':
+                self._in_string = True
+                self._string = ""
+            elif c == "{":
+                if self._depth == 0:
+                    self._reset()
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+            elif c == "[":
+                self._array_key = self._key
+            elif self._array_key is not None and (c.isdigit() or c == "-"):
+                self._number += c
+            else:
+                self._emit()
+                if c == "]":
+                    self._array_key = None
+
+
+@functools.lru_cache(maxsize=4)
+def _shared_openai(api_key: str) -> OpenAI:
+    """
+    Returns the OpenAI client for the API key, shared by all AI clients in the process,
+    so their requests reuse the pooled keep-alive connections instead of opening new ones.
+    """
+    http_client = httpx.Client(
+        timeout=OPENAI_TIMEOUT,
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS)
+    )
+    return OpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT, http_client=http_client)
+
+
+def _retry_delay(error: RateLimitError | APITimeoutError, attempt: int) -> float:
+    """
+    Returns the time (in seconds) to wait before retrying a failed request.
+
+    The `Retry-After` header of a rate limited response is honoured, otherwise the wait grows
+    exponentially with the attempt number, with random jitter, so concurrent workers don't retry at once.
+    """
+    if isinstance(error, RateLimitError):
+        try:
+            return float(error.response.headers.get("retry-after", ""))
+        except ValueError:
+            pass
+        initial = OPENAI_RETRY_INITIAL_WAIT
+    else:
+        initial = OPENAI_TIMEOUT_RETRY_INITIAL_WAIT
+    return min(OPENAI_RETRY_MAX_WAIT, initial * 2 ** attempt) + random.uniform(0, initial)
+
+
 class DiscoveryAIClient:
     """
     A class to interact with OpenAI's API for generating AI responses.
     It handles the conversation history and manages the AI model's responses.
     """
 
+    __slots__ = ("_client", "_async_client", "_semaphore", "_bucket", "_requested_model", "respondedModel",
+                 "_history", "_system_prompt", "_repeat_msg", "_cache")
+
     _client: OpenAI
+    _async_client: AsyncOpenAI
+    _semaphore: asyncio.Semaphore
+    _bucket: TokenBucket | None
     _requested_model: str
     respondedModel: str
-    _messages: list[ResponseInputItemParam]
+    _history: deque[ResponseInputItemParam]
     _system_prompt: ResponseInputItemParam
     _repeat_msg: str
+    _cache: AIResponseCache | None
 
-    def __init__(self, openai_api_key: str, openai_model: str, system_prompt: str, repeat_prompt: str) -> None:
+    def __init__(self, openai_api_key: str, openai_model: str, system_prompt: str, repeat_prompt: str, requests_per_minute: int = 0, http_client: httpx.Client | None = None, cache: AIResponseCache | None = None) -> None:
         """
         Initializes the AIClient instance.
 
@@ -43,67 +188,211 @@ class DiscoveryAIClient:
             openai_model (str): The model to be used for generating responses.
             system_prompt (str): The system prompt to be used for the AI model - a general instruction.
             repeat_prompt (str): The prompt to be used when the AI model fails to provide a valid response.
+            requests_per_minute (int): The maximum number of requests per minute, 0 disables throttling.
+            http_client (httpx.Client | None): The HTTP client for the OpenAI API calls. If not set, a client shared
+                by all instances with the same API key is used.
+            cache (AIResponseCache | None): The on-disk cache of valid responses, None disables caching.
         """
-        self._client = OpenAI(api_key=openai_api_key, timeout=OPENAI_TIMEOUT)
+        if http_client is not None:
+            self._client = OpenAI(api_key=openai_api_key, timeout=OPENAI_TIMEOUT, http_client=http_client)
+        else:
+            self._client = _shared_openai(openai_api_key)
+        self._async_client = AsyncOpenAI(api_key=openai_api_key, timeout=OPENAI_TIMEOUT)
+        self._semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENT_REQUESTS)
+        self._bucket = TokenBucket.per_minute(requests_per_minute) if requests_per_minute > 0 else None
         self._requested_model = openai_model
         self._system_prompt = {"role": "developer", "content": system_prompt}
-        self._messages = [ self._system_prompt ]
+        self._history = deque(maxlen=OPENAI_MESSAGES_HISTORY - 1)  # the system prompt is sent in front of the history
         self._repeat_msg = repeat_prompt
         self.respondedModel = "Ai-model-unknown"
+        self._cache = cache
 
 
-    def __query__(self, input: str, model: Type[BaseModel], validator: Callable[[Any], bool], retries: int) -> BaseModel:
-        self._messages.append({"role": "user", "content": input})
-        self._messages = self._messages[-OPENAI_MESSAGES_HISTORY:]
-        self._messages[0] = self._system_prompt
-        for _ in range(retries):
+    def _cache_key(self, request: ResponseInputItemParam, model: Type[BaseModel]) -> str | None:
+        """
+        Returns the cache key of the request, or None if caching is disabled.
+
+        The key covers the model, the response format, the system prompt and the request itself, but not the rest
+        of the history: concurrent queries extend the history in completion order, so it differs between runs.
+        Only validated responses are cached, so a cached response is a valid answer to the same request.
+        """
+        if self._cache is None:
+            return None
+        return self._cache.key(self._requested_model, model.__name__, [self._system_prompt, request])
+
+    def _cached_response(self, key: str | None, model: Type[BaseModel]) -> tuple[BaseModel, str] | None:
+        """
+        Returns the cached response for the cache key and its JSON, or None if it is not cached or can't be parsed.
+        """
+        if key is None or self._cache is None:
+            return None
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        responded_model, output = cached
+        try:
+            parsed = model.model_validate_json(output)
+        except ValueError:
+            return None
+        self.respondedModel = responded_model
+        return parsed, output
+
+
+    def __query__(self, input: str, model: Type[BaseModel], validator: Callable[[Any], bool], retries: int, on_delta: Callable[[str], None] | None = None) -> BaseModel:
+        request: ResponseInputItemParam = {"role": "user", "content": input}
+        self._history.append(request)
+        cache_key = self._cache_key(request, model)
+        for attempt in range(retries):
             try:
-                # Send the request to the AI model
-                response = self._client.responses.parse(
-                    model=self._requested_model,
-                    input=self._messages,
-                    text_format=model
-                )
-                self.respondedModel = response.model
-                responseParsed = response.output_parsed
+                messages = [self._system_prompt, *self._history]
+                cached = self._cached_response(cache_key, model) if attempt == 0 else None
+                if cached is not None:
+                    # The same query was answered before, the cached text is passed to the callback as a single delta
+                    responseParsed, output = cached
+                    if on_delta is not None:
+                        on_delta(output)
+                else:
+                    responseParsed = self._request(messages, model, on_delta)
 
                 # Base checks for the response and append it to the messages
                 if not self.respondedModel.startswith(self._requested_model):
-                    raise RuntimeError(f"Unexpected model: {response.model}. Expected: {self._requested_model}")
+                    raise RuntimeError(f"Unexpected model: {self.respondedModel}. Expected: {self._requested_model}")
                 if responseParsed is None:
                      if getattr(responseParsed, 'refusal', None):
-                        self._messages.append({"role": "assistant", "content": responseParsed.refusal}) # type: ignore
+                        self._history.append({"role": "assistant", "content": responseParsed.refusal}) # type: ignore
                      raise ValueError(f"AI Search Directions Response is None")
-                self._messages.append({"role": "assistant", "content": str(responseParsed)})
+                self._history.append({"role": "assistant", "content": str(responseParsed)})
                 
                 # Validate the response
                 if not validator(responseParsed):
                     raise ValueError("AI Search Directions Response validation failed")
                 
-                # If the response is valid, return it
+                # If the response is valid, cache and return it
+                if cache_key is not None and cached is None:
+                    self._cache.set(cache_key, self.respondedModel, responseParsed.model_dump_json())  # type: ignore
                 return responseParsed
 
             except (APIResponseValidationError, ValueError) as e:
                 # If the response is not valid, retry with the repeat prompt
-                self._messages.append({"role": "user", "content": self._repeat_msg})
+                self._history.append({"role": "user", "content": self._repeat_msg})
                 continue
-            except RateLimitError:
-                sleep(10)  # Wait before retrying on rate limit error
+            except RateLimitError as e:
+                if self._bucket:
+                    self._bucket.penalize()
+                time.sleep(_retry_delay(e, attempt))
                 continue
-            except APITimeoutError:
+            except APITimeoutError as e:
+                time.sleep(_retry_delay(e, attempt))
                 continue
         
         # If we reach here, it means we failed to get a valid response after retries
         # Prepare the history of messages for debugging and raise an exception
-        history = f""
-        for message in self._messages[-(retries*2 + 1):]:
-            history += f"> {str(message.get('role')).capitalize()}:\n{message.get('content', '')}\n\n"
-        raise Exception(f"Failed to get a valid response after {retries} attempts.\n\n{history}")
+        error_history = "\n\n".join(
+            f"> {str(message.get('role')).capitalize()}:\n{message.get('content', '')}"
+            for message in list(self._history)[-(retries*2 + 1):]
+        )
+        raise Exception(f"Failed to get a valid response after {retries} attempts.\n\n{error_history}")
+
+
+    def _request(self, messages: list[ResponseInputItemParam], model: Type[BaseModel], on_delta: Callable[[str], None] | None) -> BaseModel | None:
+        """
+        Sends the request to the AI model and returns the parsed response.
+        """
+        if self._bucket:
+            self._bucket.acquire()
+        if on_delta is None:
+            response = self._client.responses.parse(
+                model=self._requested_model,
+                input=messages,
+                text_format=model
+            )
+        else:
+            # Stream the response, passing the output text to the callback while it is being generated
+            with self._client.responses.stream(
+                model=self._requested_model,
+                input=messages,
+                text_format=model
+            ) as stream:
+                for event in stream:
+                    if event.type == "response.output_text.delta":
+                        on_delta(event.delta)
+                response = stream.get_final_response()
+        if self._bucket:
+            self._bucket.reward()
+        self.respondedModel = response.model
+        return response.output_parsed
+
+
+    async def __query_async__(self, input: str, model: Type[BaseModel], validator: Callable[[Any], bool], retries: int) -> BaseModel:
+        # Concurrent queries can't share one conversation, so each of them works on its own copy of the history.
+        # Only the successful exchange is appended to the shared history.
+        request: ResponseInputItemParam = {"role": "user", "content": input}
+        history = deque(self._history, maxlen=self._history.maxlen)
+        history.append(request)
+        cache_key = self._cache_key(request, model)
+        for attempt in range(retries):
+            try:
+                messages = [self._system_prompt, *history]
+                cached = self._cached_response(cache_key, model) if attempt == 0 else None
+                if cached is not None:
+                    responseParsed = cached[0]
+                else:
+                    # Send the request to the AI model, bounding the number of requests in flight
+                    async with self._semaphore:
+                        if self._bucket:
+                            await self._bucket.acquire_async()
+                        response = await self._async_client.responses.parse(
+                            model=self._requested_model,
+                            input=messages,
+                            text_format=model
+                        )
+                    if self._bucket:
+                        self._bucket.reward()
+                    self.respondedModel = response.model
+                    responseParsed = response.output_parsed
+
+                # Base checks for the response and append it to the messages
+                if not self.respondedModel.startswith(self._requested_model):
+                    raise RuntimeError(f"Unexpected model: {self.respondedModel}. Expected: {self._requested_model}")
+                if responseParsed is None:
+                    raise ValueError(f"AI Search Directions Response is None")
+                answer: ResponseInputItemParam = {"role": "assistant", "content": str(responseParsed)}
+                history.append(answer)
+
+                # Validate the response
+                if not validator(responseParsed):
+                    raise ValueError("AI Search Directions Response validation failed")
+
+                # If the response is valid, cache it, store the exchange and return the response
+                if cache_key is not None and cached is None:
+                    self._cache.set(cache_key, self.respondedModel, responseParsed.model_dump_json())  # type: ignore
+                self._history.extend([request, answer])
+                return responseParsed
+
+            except (APIResponseValidationError, ValueError) as e:
+                # If the response is not valid, retry with the repeat prompt
+                history.append({"role": "user", "content": self._repeat_msg})
+                continue
+            except RateLimitError as e:
+                if self._bucket:
+                    self._bucket.penalize()
+                await asyncio.sleep(_retry_delay(e, attempt))
+                continue
+            except APITimeoutError as e:
+                await asyncio.sleep(_retry_delay(e, attempt))
+                continue
+
+        # If we reach here, it means we failed to get a valid response after retries
+        error_history = "\n\n".join(
+            f"> {str(message.get('role')).capitalize()}:\n{message.get('content', '')}"
+            for message in list(history)[-(retries*2 + 1):]
+        )
+        raise Exception(f"Failed to get a valid response after {retries} attempts.\n\n{error_history}")
     
 
 
 
-    def searchDirectionsQuery(self, input: str, validator: Callable[[AISearchDirectionsResponse], bool], retries: int = 3) -> dict[str, list[int]]:
+    def searchDirectionsQuery(self, input: str, validator: Callable[[AISearchDirectionsResponse], bool], retries: int = 3) -> AISearchDirectionsResponse:
         """
         Queries the AI for search directions based on the input string.
         Args:
@@ -111,23 +400,47 @@ class DiscoveryAIClient:
             validator (Callable[[AISearchDirectionsResponse], bool]): A function to validate the AI response.
             retries (int): The number of retries in case of failure.
         Returns:
-            dict[str, list[int]]: A dictionary containing the search directions with keys "add", "partly", and "skip".
+            AISearchDirectionsResponse: The validated search directions, in the "add", "partly", and "skip" lists.
         Raises:
             ValueError: If the response is not of the expected type or does not match the validation criteria.
             Exception: If the AI fails to provide a valid response after the specified number of retries, an Exception is raised with the message history for debugging.
         """
         directions = self.__query__(input, AISearchDirectionsResponse, validator, retries)
         if isinstance(directions, AISearchDirectionsResponse):
-            return {
-                "add": directions.add,
-                "partly": directions.partly,
-                "skip": directions.skip
-            }
+            return directions
         else:
             raise ValueError(f"Unexpected response type: {type(directions)}. Expected AISearchDirectionsResponse.")
     
 
-    def partlyAddQuery(self, input: str, validator: Callable[[AIPartlyAddAnswer], bool], retries: int = 3) -> list[str]:
+    def searchDirectionsQueryStream(self, input: str, validator: Callable[[AISearchDirectionsResponse], bool], on_add: Callable[[int], None], on_partly: Callable[[int], None], retries: int = 3) -> AISearchDirectionsResponse:
+        """
+        Queries the AI for search directions like `searchDirectionsQuery`, but streams the response.
+        Directions are passed to the callbacks as soon as they appear in the generated "add" and "partly" lists,
+        so the work on them can start before the whole response is generated.
+
+        Callbacks are called once per direction, even if the query is retried. Directions passed to the callbacks
+        are not validated yet, the returned response is the final validated decision.
+        Args:
+            input (str): The input string to query the AI.
+            validator (Callable[[AISearchDirectionsResponse], bool]): A function to validate the AI response.
+            on_add (Callable[[int], None]): A function called for each direction in the "add" list.
+            on_partly (Callable[[int], None]): A function called for each direction in the "partly" list.
+            retries (int): The number of retries in case of failure.
+        Returns:
+            AISearchDirectionsResponse: The validated search directions, in the "add", "partly", and "skip" lists.
+        Raises:
+            ValueError: If the response is not of the expected type or does not match the validation criteria.
+            Exception: If the AI fails to provide a valid response after the specified number of retries, an Exception is raised with the message history for debugging.
+        """
+        scanner = DirectionsStreamScanner({"add": on_add, "partly": on_partly})
+        directions = self.__query__(input, AISearchDirectionsResponse, validator, retries, on_delta=scanner.feed)
+        if isinstance(directions, AISearchDirectionsResponse):
+            return directions
+        else:
+            raise ValueError(f"Unexpected response type: {type(directions)}. Expected AISearchDirectionsResponse.")
+    
+
+    def partlyAddQuery(self, input: str, validator: Callable[[AIPartlyAddAnswer], bool], retries: int = 3) -> AIPartlyAddAnswer:
         """
         Queries the AI for a list of nodes to be added partly based on the input string.
         Args:
@@ -135,13 +448,34 @@ class DiscoveryAIClient:
             validator (Callable[[AIPartlyAddAnswer], bool]): A function to validate the AI response.
             retries (int): The number of retries in case of failure.
         Returns:
-            list[str]: A list of nodes to be added partly.
+            AIPartlyAddAnswer: The validated answer, with the list of nodes to be added partly in `nodes`.
         Raises:
             ValueError: If the response is not of the expected type or does not match the validation criteria.
             Exception: If the AI fails to provide a valid response after the specified number of retries, an Exception is raised with the message history for debugging.
         """
         answer = self.__query__(input, AIPartlyAddAnswer, validator, retries)
         if isinstance(answer, AIPartlyAddAnswer):
-            return answer.nodes
+            return answer
+        else:
+            raise ValueError(f"Unexpected response type: {type(answer)}. Expected AIPartlyAddAnswer.")
+
+
+    async def partlyAddQueryBatchAsync(self, input: str, validator: Callable[[AIPartlyBatchAnswer], bool], retries: int = 3) -> dict[int, list[str]]:
+        """
+        Queries the AI to review several parts of a "partly" group at once, saving a round-trip per part.
+        The query is asynchronous, so batches of several groups can be reviewed concurrently.
+        Args:
+            input (str): The input string to query the AI, containing all numbered parts.
+            validator (Callable[[AIPartlyBatchAnswer], bool]): A function to validate the AI response.
+            retries (int): The number of retries in case of failure.
+        Returns:
+            dict[int, list[str]]: A dictionary mapping part indexes to the lists of nodes to be added.
+        Raises:
+            ValueError: If the response is not of the expected type or does not match the validation criteria.
+            Exception: If the AI fails to provide a valid response after the specified number of retries, an Exception is raised with the message history for debugging.
+        """
+        answer = await self.__query_async__(input, AIPartlyBatchAnswer, validator, retries)
+        if isinstance(answer, AIPartlyBatchAnswer):
+            return {p.part: p.nodes for p in answer.parts}
         else:
-            raise ValueError(f"Unexpected response type: {type(answer)}. Expected AIPartlyAddAnswer.")
\ No newline at end of file
+            raise ValueError(f"Unexpected response type: {type(answer)}. Expected AIPartlyBatchAnswer.")
\ No newline at end of file
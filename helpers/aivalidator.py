@@ -1,5 +1,5 @@
-from typing import Any
-from .aiclient import AISearchDirectionsResponse, AIPartlyAddAnswer
+from typing import Any, Iterable
+from .aiclient import AISearchDirectionsResponse, AIPartlyAddAnswer, AIPartlyBatchAnswer
 
 class DiscoveryAiValidator:
     """
@@ -8,10 +8,16 @@ class DiscoveryAiValidator:
     Attributes:
         _directions (list[dict[str, Any]]): List of search directions to validate against.
         _max_partly_count (int): Maximum size of item list to be requested as "partly" for additional AI review.
+        _direction_id_set (frozenset[int]): IDs of the search directions.
+        _valid_partly_ids (frozenset[int]): IDs of the search directions small enough to be requested as "partly".
     """
 
+    __slots__ = ("_directions", "_max_partly_count", "_direction_id_set", "_valid_partly_ids")
+
     _directions: list[dict[str, Any]]  # see SearchDirection class
     _max_partly_count: int
+    _direction_id_set: frozenset[int]
+    _valid_partly_ids: frozenset[int]
 
     def __init__(self, directions: list[dict[str, Any]], max_partly_count: int) -> None:
         """
@@ -23,6 +29,8 @@ class DiscoveryAiValidator:
         """
         self._directions = directions
         self._max_partly_count = max_partly_count
+        self._direction_id_set = frozenset(d["id"] for d in directions)
+        self._valid_partly_ids = frozenset(d["id"] for d in directions if d["count"] <= max_partly_count)
 
     def validate(self, answer: AISearchDirectionsResponse) -> bool:
         """
@@ -35,18 +43,12 @@ class DiscoveryAiValidator:
             bool: True if the response is valid, False otherwise.
         """
         try:
-            received_directions: list[int] = []
-            for key in ["add", "skip", "partly"]:
-                if not all(isinstance(v, int) for v in getattr(answer, key, [])):
-                    return False
-                received_directions.extend(getattr(answer, key, []))
-            direction_ids = [d["id"] for d in self._directions]
-            if not all(v in direction_ids for v in received_directions):
+            # Types of the received IDs are enforced by the `AISearchDirectionsResponse` schema
+            received = (*answer.add, *answer.skip, *answer.partly)
+            if not self._direction_id_set.issuperset(received):
+                return False
+            if not self._valid_partly_ids.issuperset(answer.partly):
                 return False
-            for id in getattr(answer, "partly", []):
-                count = next(d["count"] for d in self._directions if d["id"] == id)
-                if count > self._max_partly_count:
-                    return False
             return True
         except Exception:
             return False
@@ -57,18 +59,20 @@ class DiscoveryAiValidatorPartly:
     Validates AI responses for the discovery process when adding nodes partly.
 
     Attributes:
-        _nodes (list[str]): List of nodes to validate against.
+        _nodes (frozenset[str]): Set of nodes to validate against.
     """
 
-    _nodes: list[str]
+    __slots__ = ("_nodes",)
+
+    _nodes: frozenset[str]
 
-    def __init__(self, nodes: list[str]) -> None:
+    def __init__(self, nodes: Iterable[str]) -> None:
         """
         Initializes the DiscoveryAiValidatorPartly instance.
         Args:
-            nodes (list[str]): A list of nodes to validate against.
+            nodes (Iterable[str]): Nodes to validate against.
         """
-        self._nodes = nodes
+        self._nodes = frozenset(nodes)
 
     def validate(self, answer: AIPartlyAddAnswer) -> bool:
         """
@@ -78,6 +82,43 @@ class DiscoveryAiValidatorPartly:
         Returns:
             bool: True if the response is valid, False otherwise.
         """
-        if not all(node in self._nodes for node in answer.nodes):
+        return self._nodes.issuperset(answer.nodes)
+
+
+class DiscoveryAiValidatorPartlyBatch:
+    """
+    Validates AI responses for the discovery process when several parts of a group are reviewed at once.
+
+    Attributes:
+        _parts (list[set[str] | frozenset[str]]): List of parts, each one is a set of nodes to validate against.
+    """
+
+    __slots__ = ("_parts",)
+
+    _parts: list[set[str] | frozenset[str]]
+
+    def __init__(self, parts: list[set[str] | frozenset[str]]) -> None:
+        """
+        Initializes the DiscoveryAiValidatorPartlyBatch instance.
+        Args:
+            parts (list[set[str] | frozenset[str]]): A list of parts, indexed as in the AI request, to validate against.
+                Sets (e.g. `Node` objects) are used as is, without copying.
+        """
+        self._parts = parts
+
+    def validate(self, answer: AIPartlyBatchAnswer) -> bool:
+        """
+        Validates the AI response for a batch of partly added nodes.
+        Every part must be answered exactly once and contain only nodes of that part.
+        Args:
+            answer (AIPartlyBatchAnswer): The AI response to validate.
+        Returns:
+            bool: True if the response is valid, False otherwise.
+        """
+        answered = [p.part for p in answer.parts]
+        if sorted(answered) != list(range(len(self._parts))):
             return False
+        for p in answer.parts:
+            if not self._parts[p.part].issuperset(p.nodes):
+                return False
         return True
\ No newline at end of file